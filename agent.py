@@ -4,16 +4,27 @@ LiteLLM MCP Agent - Working Implementation
 Based on the test_mcp_client.py pattern from Joseph1977/py-mcp-server
 """
 import asyncio
+import hashlib
 import json
 import logging
 import os
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import AsyncExitStack
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Tuple, TypeVar
 
+import anyio
 import httpx
+import orjson
 from dotenv import load_dotenv
 from mcp import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED, ErrorData
+from pydantic import BaseModel
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +33,73 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+class MCPSessionClosedError(Exception):
+    """Raised when a call on a pooled MCP session never reached the server: the transport had already shut down, or the server rejected the session"""
+
+
+# Errors raised before a request could be sent, because the session's streams had gone away;
+# retrying these cannot run an operation twice on the server
+UNSENT_REQUEST_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, MCPSessionClosedError)
+
+
+def _is_stale_session_error(error: BaseException) -> bool:
+    """Whether error means the MCP session is unusable and should be reopened"""
+    if isinstance(error, UNSENT_REQUEST_ERRORS):
+        return True
+    # The SDK reports a connection dropped with requests still pending as McpError
+    return isinstance(error, McpError) and error.error.code == CONNECTION_CLOSED
+
+
+def _is_rejected_request_error(error: Optional[BaseException]) -> bool:
+    """
+    Whether error, which closed a session's transport, came from a request the server never
+    ran: the connection could not be made, or the server refused the session (as it does
+    for a session opened before it restarted)
+    """
+    sub_errors = getattr(error, "exceptions", None)
+    if sub_errors:
+        return all(_is_rejected_request_error(e) for e in sub_errors)
+    if isinstance(error, httpx.ConnectError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (
+        httpx.codes.BAD_REQUEST, httpx.codes.NOT_FOUND
+    )
+
+# Synthetic function that lets the model run many MCP tool calls in a single turn
+MCP_BATCH_FUNCTION = {
+    "name": "mcp_batch",
+    "description": (
+        "Run several MCP tool calls concurrently in one step and get all of their "
+        "results back as a list, in the same order as the calls."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "calls": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "tool": {"type": "string", "description": "Name of the MCP tool to call"},
+                        "args": {"type": "object", "description": "Arguments for the tool"}
+                    },
+                    "required": ["tool"]
+                }
+            }
+        },
+        "required": ["calls"]
+    }
+}
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant with access to tools from an MCP server. "
+    "When a task needs the same tool for many items, or several independent tool calls, "
+    "use the mcp_batch function to run them all in one step instead of calling tools one at a time."
+)
+
 
 @dataclass
 class MCPTool:
@@ -29,6 +107,163 @@ class MCPTool:
     name: str
     description: str
     input_schema: dict
+    read_only: bool = False
+
+
+class MCPToolError(Exception):
+    """Raised when an MCP tool call completes but the server marks its result as an error"""
+
+
+class MCPSessionPool:
+    """
+    Keeps one initialized MCP ClientSession open per server URL.
+
+    Each session is owned by a background task holding an AsyncExitStack with the
+    streamablehttp_client and ClientSession contexts, so the anyio task groups
+    behind them are entered and exited by the same task regardless of which
+    caller first acquired the session.
+    """
+
+    def __init__(self, read_timeout: Optional[float] = None):
+        # Optional upper bound on waiting for any one response; a request lost with its
+        # connection already fails through run(), so this only limits slow servers
+        self._read_timeout = timedelta(seconds=read_timeout) if read_timeout else None
+        self._sessions: Dict[str, ClientSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._closers: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def acquire(self, url: str) -> ClientSession:
+        """Return the open session for url, connecting and initializing it on first use"""
+        session = self._sessions.get(url)
+        if session is not None:
+            return session
+
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(url)
+            if session is None:
+                session = await self._open(url)
+            return session
+
+    async def invalidate(self, url: str, session: Optional[ClientSession] = None) -> None:
+        """
+        Close the pooled session for url so the next acquire() reconnects.
+
+        If session is given, only close the pooled session when it is still that
+        one, so concurrent callers failing on the same stale session don't tear
+        down a replacement another caller has just opened.
+        """
+        if session is not None and self._sessions.get(url) is not session:
+            return
+
+        self._sessions.pop(url, None)
+        closer = self._closers.pop(url, None)
+        task = self._tasks.pop(url, None)
+        if closer is not None:
+            closer.set()
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def run(
+        self,
+        url: str,
+        session: ClientSession,
+        operation: Callable[[ClientSession], Awaitable[T]]
+    ) -> T:
+        """
+        Run operation on a session acquired from this pool.
+        
+        Raises MCPSessionClosedError if the session's owner task has already exited, or exits
+        because the server rejected the request unrun; and McpError (CONNECTION_CLOSED) if it
+        exits for any other reason while the operation is in flight, since the server may
+        have run it. Requests in flight on a dead transport would otherwise never be answered.
+        """
+        holder = self._tasks.get(url) if self._sessions.get(url) is session else None
+        if holder is None or holder.done():
+            raise MCPSessionClosedError(f"MCP session to {url} is closed")
+        
+        call = asyncio.ensure_future(operation(session))
+        try:
+            await asyncio.wait({call, holder}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            call.cancel()
+            raise
+        
+        if not call.done():
+            call.cancel()
+            await asyncio.gather(call, return_exceptions=True)
+            if not holder.cancelled() and _is_rejected_request_error(holder.result()):
+                raise MCPSessionClosedError(f"MCP session to {url} was rejected by the server")
+            raise McpError(ErrorData(
+                code=CONNECTION_CLOSED,
+                message=f"MCP session to {url} closed while a request was in flight"
+            ))
+        return call.result()
+
+    async def aclose(self) -> None:
+        """Close every pooled session"""
+        for url in list(self._tasks):
+            await self.invalidate(url)
+
+    async def _open(self, url: str) -> ClientSession:
+        ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        closer = asyncio.Event()
+        task = asyncio.create_task(self._hold(url, ready, closer))
+
+        try:
+            session = await ready
+        except BaseException:
+            task.cancel()
+            raise
+
+        self._sessions[url] = session
+        self._closers[url] = closer
+        self._tasks[url] = task
+        return session
+
+    async def _hold(self, url: str, ready: asyncio.Future, closer: asyncio.Event) -> Optional[Exception]:
+        """Own the session for url until closer is set; return the error that closed it early, if any"""
+        async def on_message(message: Any) -> None:
+            # The transport passes on errors reading a response, e.g. the server going away
+            # mid-request; that request will never be answered, so close the session
+            if isinstance(message, Exception):
+                logger.warning("MCP transport error from %s: %s", url, message)
+                closer.set()
+        
+        try:
+            async with AsyncExitStack() as stack:
+                logger.info("Connecting to MCP server at %s", url)
+                read_stream, write_stream, _ = await stack.enter_async_context(
+                    streamablehttp_client(url)
+                )
+                session = await stack.enter_async_context(
+                    ClientSession(
+                        read_stream,
+                        write_stream,
+                        read_timeout_seconds=self._read_timeout,
+                        message_handler=on_message
+                    )
+                )
+
+                logger.info("Initializing MCP session...")
+                await session.initialize()
+                logger.info("✅ MCP session initialized successfully!")
+
+                ready.set_result(session)
+                await closer.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning("MCP session to %s closed unexpectedly: %s", url, e)
+            return e
+        finally:
+            # Drop a session that died on its own so the next acquire() reconnects
+            if self._tasks.get(url) is asyncio.current_task():
+                self._sessions.pop(url, None)
+                self._closers.pop(url, None)
+                self._tasks.pop(url, None)
 
 
 class LiteLLMAgent:
@@ -37,159 +272,460 @@ class LiteLLMAgent:
     
     This agent:
     1. Connects to an MCP server to fetch available tools
-    2. Converts MCP tools to LiteLLM function format
+    2. Converts MCP tools to LiteLLM (OpenAI) tool format
     3. Calls LiteLLM with the tools and user request
     4. Executes any tool calls on the MCP server
     5. Returns the final response
     """
     
+    # Parameters schema for tools without one; shared by all such tools since it is never mutated
+    _DEFAULT_SCHEMA = {"type": "object", "properties": {}, "required": []}
+    
     def __init__(
         self,
         mcp_server_url: str = None,
         litellm_base_url: str = None,
-        litellm_api_key: str = None
+        litellm_api_key: str = None,
+        cacheable_tools: Optional[List[str]] = None
     ):
         self.mcp_server_url = mcp_server_url or os.getenv("MCP_SERVER_URL", "http://localhost:8001/mcp")
         self.litellm_base_url = litellm_base_url or os.getenv("LITELLM_BASE_URL", "http://localhost:4000")
         self.litellm_api_key = litellm_api_key or os.getenv("LITELLM_API_KEY", "sk-1234")
+        self._chat_url = f"{self.litellm_base_url}/v1/chat/completions"
+        
+        # Tools whose results may be reused for identical arguments, in addition to
+        # any tool the MCP server marks with annotations.readOnlyHint
+        if cacheable_tools is None:
+            cacheable_tools = [t for t in os.getenv("MCP_CACHEABLE_TOOLS", "").split(",") if t.strip()]
+        self.cacheable_tools = {t.strip() for t in cacheable_tools}
         
         self.mcp_tools: List[MCPTool] = []
-        logger.info(f"Initialized LiteLLMAgent with MCP server: {self.mcp_server_url}")
-        logger.info(f"LiteLLM server: {self.litellm_base_url}")
+        # (fetched_at, MCP tools, LiteLLM function definitions) from the last list_tools()
+        self._tools_cache: Optional[Tuple[float, List[MCPTool], List[dict]]] = None
+        self._tools_ttl = 300
+        self._tools_prefetch: Optional[asyncio.Task] = None
+        # (LiteLLM tools, pre-serialized ',"tools":...' request body fragment for them)
+        self._tools_json_fragment: Optional[Tuple[List[dict], bytes]] = None
+        # LRU of (stored_at, tool result) keyed by a hash of (tool name, arguments); entries
+        # expire after _call_cache_ttl seconds since read-only results still change over time
+        self._call_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._call_cache_max = 256
+        self._call_cache_ttl = float(os.getenv("MCP_CACHE_TTL", "60"))
+        read_timeout = os.getenv("MCP_READ_TIMEOUT")
+        self._pool = MCPSessionPool(read_timeout=float(read_timeout) if read_timeout else None)
+        # Caps concurrent MCP tool calls when a turn (or mcp_batch) fans out many of them
+        self._mcp_sem = asyncio.Semaphore(int(os.getenv("MCP_MAX_INFLIGHT", "16")))
+        self._http: Optional[httpx.AsyncClient] = None
+        logger.info("Initialized LiteLLMAgent with MCP server: %s", self.mcp_server_url)
+        logger.info("LiteLLM server: %s", self.litellm_base_url)
+
+    async def __aenter__(self) -> "LiteLLMAgent":
+        await self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+    async def initialize(self) -> None:
+        """Open the pooled MCP session up front so the first request skips the connect/initialize handshake"""
+        await self._pool.acquire(self.mcp_server_url)
+
+    async def aclose(self) -> None:
+        """Close the pooled MCP session(s) and the shared LiteLLM HTTP client"""
+        if self._tools_prefetch is not None:
+            self._tools_prefetch.cancel()
+            await asyncio.gather(self._tools_prefetch, return_exceptions=True)
+            self._tools_prefetch = None
+        await self._pool.aclose()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def prefetch_tools(self) -> asyncio.Task:
+        """
+        Start fetching the MCP tool list in the background.
+        
+        The next process_request() waits for this fetch instead of starting its own, so the
+        MCP handshake can overlap with other work such as waiting for user input.
+        """
+        if self._tools_prefetch is None:
+            self._tools_prefetch = asyncio.create_task(self._fetch_mcp_tools())
+        return self._tools_prefetch
+
+    def invalidate_tools_cache(self) -> None:
+        """Forget the cached tool list so the next request re-fetches it from the MCP server"""
+        self._tools_cache = None
+
+    async def _ensure_client(self) -> httpx.AsyncClient:
+        """Return the shared keep-alive HTTP client for LiteLLM, creating it on first use"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_keepalive_connections=20,
+                    max_connections=100,
+                    keepalive_expiry=30.0
+                ),
+                timeout=httpx.Timeout(60.0),
+                headers={
+                    "Authorization": f"Bearer {self.litellm_api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._http
+
+    async def _with_mcp_session(
+        self,
+        operation: Callable[[ClientSession], Awaitable[T]],
+        idempotent: bool = False
+    ) -> T:
+        """
+        Run operation on the pooled MCP session, reconnecting once if it has gone stale.
+        
+        A non-idempotent operation is only retried when its request never reached the
+        server; if the session died while it was in flight, the error is raised instead
+        so a tool with side effects is not run twice.
+        """
+        session = await self._pool.acquire(self.mcp_server_url)
+        try:
+            return await self._pool.run(self.mcp_server_url, session, operation)
+        except Exception as e:
+            if not _is_stale_session_error(e):
+                raise
+            self.invalidate_tools_cache()
+            await self._pool.invalidate(self.mcp_server_url, session)
+            if not idempotent and not isinstance(e, UNSENT_REQUEST_ERRORS):
+                logger.warning("MCP session closed while a request was in flight (%s)", e)
+                raise
+            logger.warning("MCP session is unusable (%s), reconnecting...", e)
+            session = await self._pool.acquire(self.mcp_server_url)
+            return await self._pool.run(self.mcp_server_url, session, operation)
 
     async def _fetch_mcp_tools(self) -> List[MCPTool]:
-        """Fetch available tools from the MCP server using the official MCP client"""
+        """
+        Fetch available tools from the MCP server using the official MCP client.
+        
+        The tool list and its LiteLLM conversion are cached for self._tools_ttl seconds.
+        """
+        if self._tools_cache and time.monotonic() - self._tools_cache[0] < self._tools_ttl:
+            return self._tools_cache[1]
+        
         try:
-            logger.info(f"Connecting to MCP server at {self.mcp_server_url}")
+            # List available tools
+            logger.info("📋 Fetching available tools...")
+            tools_response = await self._with_mcp_session(
+                lambda session: session.list_tools(), idempotent=True
+            )
             
-            # Use the same pattern as test_mcp_client.py from the GitHub repo
-            async with streamablehttp_client(self.mcp_server_url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the MCP session
-                    logger.info("Initializing MCP session...")
-                    await session.initialize()
-                    logger.info("✅ MCP session initialized successfully!")
-                    
-                    # List available tools
-                    logger.info("📋 Fetching available tools...")
-                    tools_response = await session.list_tools()
-                    
-                    mcp_tools = []
-                    for tool in tools_response.tools:
-                        # Convert MCP tool to our internal format
-                        input_schema = {}
-                        if hasattr(tool, 'inputSchema') and tool.inputSchema:
-                            # Convert the MCP input schema to dict
-                            if hasattr(tool.inputSchema, '__dict__'):
-                                input_schema = tool.inputSchema.__dict__
-                            else:
-                                input_schema = dict(tool.inputSchema)
-                        
-                        mcp_tool = MCPTool(
-                            name=tool.name,
-                            description=tool.description,
-                            input_schema=input_schema
-                        )
-                        mcp_tools.append(mcp_tool)
-                        
-                        logger.info(f"  - {tool.name}: {tool.description}")
-                    
-                    logger.info(f"✅ Found {len(mcp_tools)} MCP tools")
-                    return mcp_tools
+            mcp_tools = []
+            for tool in tools_response.tools:
+                # Convert MCP tool to our internal format; the SDK gives the input schema
+                # as plain JSON data, or as a Pydantic model in some SDK versions
+                input_schema = getattr(tool, "inputSchema", None)
+                if input_schema is None:
+                    input_schema = {"type": "object", "properties": {}}
+                elif isinstance(input_schema, BaseModel):
+                    input_schema = input_schema.model_dump(mode="json", exclude_none=True)
+                
+                annotations = getattr(tool, "annotations", None)
+                mcp_tool = MCPTool(
+                    name=tool.name,
+                    description=tool.description,
+                    input_schema=input_schema,
+                    read_only=bool(annotations and annotations.readOnlyHint)
+                )
+                mcp_tools.append(mcp_tool)
+                
+                logger.info("  - %s: %s", tool.name, tool.description)
+            
+            logger.info("✅ Found %s MCP tools", len(mcp_tools))
+            
+            litellm_tools = self._convert_mcp_tools_to_litellm(mcp_tools)
+            self._tools_cache = (time.monotonic(), mcp_tools, litellm_tools)
+            return mcp_tools
                     
         except Exception as e:
-            logger.error(f"Failed to fetch MCP tools: {e}")
+            logger.error("Failed to fetch MCP tools: %s", e)
+            self.invalidate_tools_cache()
             raise
 
-    async def _execute_mcp_tool(self, tool_name: str, arguments: dict) -> dict:
-        """Execute a tool on the MCP server"""
+    def _is_cacheable(self, tool_name: str) -> bool:
+        """Whether results of tool_name may be reused for identical arguments"""
+        if tool_name in self.cacheable_tools:
+            return True
+        return any(tool.name == tool_name and tool.read_only for tool in self.mcp_tools)
+
+    async def _execute_mcp_tool(self, tool_name: str, arguments: dict) -> str:
+        """
+        Execute a tool on the MCP server, reusing cached results of read-only tools
+        
+        Returns the text of the first content item. Raises MCPToolError if the server
+        reports the call as failed, or the underlying error if the call itself fails.
+        """
+        cache_key = None
+        if self._is_cacheable(tool_name):
+            cache_key = hashlib.blake2b(
+                tool_name.encode() + b":" + orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS),
+                digest_size=16
+            ).hexdigest()
+            cached = self._call_cache.get(cache_key)
+            if cached is not None:
+                if time.monotonic() - cached[0] < self._call_cache_ttl:
+                    self._call_cache.move_to_end(cache_key)
+                    logger.info("Using cached result for MCP tool: %s", tool_name)
+                    return cached[1]
+                del self._call_cache[cache_key]
+        
         try:
-            logger.info(f"Executing MCP tool: {tool_name} with args: {arguments}")
+            logger.info("Executing MCP tool: %s with args: %s", tool_name, arguments)
             
-            async with streamablehttp_client(self.mcp_server_url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    
-                    # Call the tool
-                    result = await session.call_tool(tool_name, arguments)
-                    
-                    # Extract the result content
-                    if result.content:
-                        # Return the text content from the first content item
-                        return {"result": result.content[0].text if result.content[0].text else str(result.content[0])}
-                    else:
-                        return {"result": "Tool executed successfully but returned no content"}
+            # Call the tool
+            async with self._mcp_sem:
+                result = await self._with_mcp_session(
+                    lambda session: session.call_tool(tool_name, arguments)
+                )
                         
         except Exception as e:
-            logger.error(f"Failed to execute MCP tool {tool_name}: {e}")
-            return {"error": f"Tool execution failed: {str(e)}"}
+            logger.error("Failed to execute MCP tool %s: %s", tool_name, e)
+            self.invalidate_tools_cache()
+            raise
+        
+        # Return the text content from the first content item
+        tool_result = result.content[0].text if (result.content and hasattr(result.content[0], "text")) else ""
+        
+        if result.isError:
+            logger.warning("MCP tool %s returned an error: %s", tool_name, tool_result)
+            raise MCPToolError(tool_result or f"Tool {tool_name} reported an error")
+        
+        if cache_key is not None:
+            self._call_cache[cache_key] = (time.monotonic(), tool_result)
+            self._call_cache.move_to_end(cache_key)
+            if len(self._call_cache) > self._call_cache_max:
+                self._call_cache.popitem(last=False)
+        
+        return tool_result
 
-    def _convert_mcp_tools_to_litellm(self, mcp_tools: List[MCPTool]) -> List[dict]:
-        """Convert MCP tools to LiteLLM function format"""
-        litellm_functions = []
+    async def _execute_mcp_batch(self, arguments: Any) -> str:
+        """
+        Execute the calls of an mcp_batch request concurrently over the pooled MCP session
         
-        for tool in mcp_tools:
-            # Convert MCP tool schema to LiteLLM function format
-            function_def = {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": tool.input_schema if tool.input_schema else {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
+        Returns a JSON list with each call's result (or error), in the order of the calls.
+        Raises ValueError if the arguments are not an object with a "calls" array.
+        """
+        calls = arguments.get("calls") if isinstance(arguments, dict) else None
+        if not isinstance(calls, list):
+            raise ValueError('mcp_batch expects an object with a "calls" array')
+        
+        async def invalid_call() -> str:
+            raise ValueError('each mcp_batch call must be an object with "tool" and "args"')
+        
+        logger.info("Executing MCP batch of %s tool calls", len(calls))
+        results = await asyncio.gather(
+            *[
+                self._execute_mcp_tool(call.get("tool"), call.get("args") or {})
+                if isinstance(call, dict) else invalid_call()
+                for call in calls
+            ],
+            return_exceptions=True
+        )
+        
+        merged = []
+        for call, result in zip(calls, results):
+            tool = call.get("tool") if isinstance(call, dict) else None
+            if isinstance(result, BaseException):
+                merged.append({"tool": tool, "error": f"Tool execution failed: {str(result)}"})
+            else:
+                merged.append({"tool": tool, "result": result})
+        return orjson.dumps({"results": merged}).decode()
+
+    def _convert_mcp_tools_to_litellm(self, mcp_tools: List[MCPTool]) -> List[dict]:
+        """Convert MCP tools to LiteLLM (OpenAI) tool format"""
+        litellm_tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.input_schema or self._DEFAULT_SCHEMA
                 }
             }
-            litellm_functions.append(function_def)
+            for tool in mcp_tools
+        ]
+        
+        if litellm_tools:
+            litellm_tools.append({"type": "function", "function": MCP_BATCH_FUNCTION})
             
-        logger.info(f"Converted {len(litellm_functions)} MCP tools to LiteLLM format")
-        return litellm_functions
+        logger.info("Converted %s MCP tools to LiteLLM format", len(mcp_tools))
+        return litellm_tools
 
     async def _call_litellm(
         self, 
         messages: List[dict], 
         model: str = "gpt-3.5-turbo",
-        functions: List[dict] = None
+        tools: List[dict] = None,
+        stream: bool = False,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> dict:
-        """Call LiteLLM server with the request"""
+        """
+        Call LiteLLM server with the request
+        
+        With stream=True the completion is requested as server-sent events, on_delta is
+        called with each content chunk as it arrives (then with "\n" once the turn's text
+        is complete), and the chunks are assembled into the same response shape as a
+        non-streaming call.
+        """
         try:
-            url = f"{self.litellm_base_url}/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.litellm_api_key}",
-                "Content-Type": "application/json"
-            }
-            
             data = {
                 "model": model,
                 "messages": messages
             }
+            if stream:
+                data["stream"] = True
+                data["stream_options"] = {"include_usage": True}
             
-            if functions:
-                data["functions"] = functions
-                data["function_call"] = "auto"
+            # The tool schemas don't change between turns, so they are serialized once
+            # and spliced into the JSON body in front of its closing brace
+            body = orjson.dumps(data)
+            if tools:
+                body = body[:-1] + self._tools_fragment(tools) + b"}"
             
-            logger.info(f"Calling LiteLLM at {url} with model {model}")
-            logger.debug(f"Request data: {json.dumps(data, indent=2)}")
+            logger.info("Calling LiteLLM at %s with model %s", self._chat_url, model)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Request data: %s", body.decode())
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, headers=headers, json=data, timeout=60.0)
-                
-                if response.status_code != 200:
-                    logger.error(f"LiteLLM request failed: {response.status_code} - {response.text}")
-                    raise Exception(f"LiteLLM request failed: {response.status_code}")
-                
-                result = response.json()
-                logger.info("✅ LiteLLM request successful")
-                return result
+            client = await self._ensure_client()
+            if stream:
+                return await self._stream_litellm(client, body, on_delta)
+            
+            response = await client.post(self._chat_url, content=body)
+            
+            if response.status_code != 200:
+                logger.error("LiteLLM request failed: %s - %s", response.status_code, response.text)
+                raise Exception(f"LiteLLM request failed: {response.status_code}")
+            
+            result = orjson.loads(response.content)
+            logger.info("✅ LiteLLM request successful")
+            return result
                 
         except Exception as e:
-            logger.error(f"Failed to call LiteLLM: {e}")
+            logger.error("Failed to call LiteLLM: %s", e)
             raise
 
+    def _tools_fragment(self, tools: List[dict]) -> bytes:
+        """Return the ',"tools":[...],"tool_choice":"auto",...' body fragment, serialized once per tool list"""
+        if self._tools_json_fragment is None or self._tools_json_fragment[0] is not tools:
+            fragment = (
+                b',"tools":' + orjson.dumps(tools)
+                + b',"tool_choice":"auto","parallel_tool_calls":true'
+            )
+            self._tools_json_fragment = (tools, fragment)
+        return self._tools_json_fragment[1]
+
+    async def _stream_litellm(
+        self,
+        client: httpx.AsyncClient,
+        body: bytes,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> dict:
+        """POST a streaming chat completion and accumulate its SSE deltas into a final message"""
+        message = {"role": "assistant", "content": ""}
+        tool_calls: Dict[int, dict] = {}
+        finish_reason = None
+        usage = {}
+        
+        async with client.stream("POST", self._chat_url, content=body) as response:
+            if response.status_code != 200:
+                error_body = await response.aread()
+                logger.error("LiteLLM request failed: %s - %s", response.status_code, error_body.decode(errors='replace'))
+                raise Exception(f"LiteLLM request failed: {response.status_code}")
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                
+                chunk = orjson.loads(payload)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    
+                    content = delta.get("content")
+                    if content:
+                        message["content"] += content
+                        if on_delta:
+                            on_delta(content)
+                    
+                    # Tool calls arrive in fragments keyed by index; names and arguments are concatenated
+                    for tool_call_delta in delta.get("tool_calls") or []:
+                        tool_call = tool_calls.setdefault(tool_call_delta.get("index", 0), {
+                            "id": None,
+                            "type": "function",
+                            "function": {"name": "", "arguments": ""}
+                        })
+                        if tool_call_delta.get("id"):
+                            tool_call["id"] = tool_call_delta["id"]
+                        function = tool_call_delta.get("function") or {}
+                        if function.get("name"):
+                            tool_call["function"]["name"] += function["name"]
+                        if function.get("arguments"):
+                            tool_call["function"]["arguments"] += function["arguments"]
+                    
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+        
+        # End the turn's streamed text with a newline, so text from the next turn (after
+        # any tool calls) and later log lines start on a line of their own
+        if on_delta and message["content"]:
+            on_delta("\n")
+        
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+            if not message["content"]:
+                message["content"] = None
+        
+        logger.info("✅ LiteLLM streaming request successful")
+        return {
+            "choices": [{"message": message, "finish_reason": finish_reason}],
+            "usage": usage
+        }
+
+    def _prune_tool_history(self, messages: List[dict], keep_turns: int = 2) -> None:
+        """
+        Replace tool results older than the last keep_turns tool-calling turns with a short stub.
+        
+        The whole history is re-sent to LiteLLM on every turn, so old tool output would
+        otherwise be uploaded and re-read by the model again and again.
+        """
+        turn_starts = [
+            i for i, message in enumerate(messages)
+            if message.get("role") == "assistant" and message.get("tool_calls")
+        ]
+        if len(turn_starts) <= keep_turns:
+            return
+        
+        tool_names = {}
+        for message in messages[:turn_starts[-keep_turns]]:
+            for tool_call in message.get("tool_calls") or []:
+                tool_names[tool_call.get("id")] = tool_call["function"]["name"]
+            
+            if message.get("role") not in ("tool", "function"):
+                continue
+            content = message.get("content") or ""
+            if content.startswith("[tool ") and content.endswith(" bytes]"):
+                continue
+            name = message.get("name") or tool_names.get(message.get("tool_call_id"), "unknown")
+            message["content"] = f"[tool {name} returned {len(content.encode())} bytes]"
+
     async def process_request(
         self, 
         request: str, 
         model: str = "gpt-3.5-turbo",
-        max_tool_calls: int = 5
+        max_tool_calls: int = 5,
+        stream: bool = False,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> dict:
         """
         Process a user request with MCP tools integration
@@ -197,34 +733,56 @@ class LiteLLMAgent:
         Args:
             request: User's request/prompt
             model: LiteLLM model to use
-            max_tool_calls: Maximum number of tool calls to prevent infinite loops
+            max_tool_calls: Maximum number of tool-calling rounds to prevent infinite loops;
+                all tool calls the model requests in one turn count as a single round
+            stream: Stream LiteLLM completions instead of waiting for the full response
+            on_delta: Called with each chunk of response text as it streams in, and with
+                "\n" at the end of each turn that streamed any text
             
         Returns:
             dict: Response with final answer and execution details
         """
         try:
-            # 1. Fetch MCP tools
+            # 1. Fetch MCP tools (served from cache while fresh, or by a pending prefetch)
             logger.info("🔧 Fetching MCP tools...")
+            prefetch, self._tools_prefetch = self._tools_prefetch, None
+            if prefetch is not None:
+                # A failed prefetch is already logged; fall through to a fresh fetch
+                await asyncio.gather(prefetch, return_exceptions=True)
             self.mcp_tools = await self._fetch_mcp_tools()
             
-            # 2. Convert tools for LiteLLM
-            litellm_functions = self._convert_mcp_tools_to_litellm(self.mcp_tools)
+            # 2. Convert tools for LiteLLM (cached alongside the tool list)
+            if self._tools_cache:
+                litellm_tools = self._tools_cache[2]
+            else:
+                litellm_tools = self._convert_mcp_tools_to_litellm(self.mcp_tools)
             
             # 3. Prepare messages
             messages = [
                 {"role": "user", "content": request}
             ]
+            if litellm_tools:
+                messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
             
             tool_call_count = 0
+            tool_round = 0
+            # Signatures of the last few tool-call turns, used to spot a model stuck in a loop
+            recent_turns = deque(maxlen=3)
+            # Signatures of the last few tool calls that failed, to stop retrying a known failure
+            recent_failures = deque(maxlen=4)
+            # How many turns each distinct error output of a tool (by hash) has been seen in
+            seen_outputs: Dict[Tuple[str, str], int] = {}
             
             # 4. Main conversation loop
-            while tool_call_count < max_tool_calls:
+            while tool_round < max_tool_calls:
                 # Call LiteLLM
-                logger.info(f"🤖 Calling LiteLLM (attempt {tool_call_count + 1})")
+                logger.info("🤖 Calling LiteLLM (attempt %s)", tool_round + 1)
                 llm_response = await self._call_litellm(
                     messages=messages,
                     model=model,
-                    functions=litellm_functions if litellm_functions else None
+                    tools=litellm_tools if litellm_tools else None,
+                    stream=stream,
+                    on_delta=on_delta
                 )
                 
                 # Get the assistant's response
@@ -234,10 +792,10 @@ class LiteLLMAgent:
                 # Add assistant message to conversation
                 messages.append(message)
                 
-                # Check if the assistant wants to call a function
-                function_call = message.get("function_call")
-                if not function_call:
-                    # No function call, return the final response
+                # Check if the assistant wants to call any tools
+                tool_calls = message.get("tool_calls") or []
+                if not tool_calls:
+                    # No tool calls, return the final response
                     logger.info("✅ Request completed - no tool calls needed")
                     return {
                         "success": True,
@@ -246,43 +804,118 @@ class LiteLLMAgent:
                         "total_tokens": llm_response.get("usage", {}).get("total_tokens", 0)
                     }
                 
-                # Execute the function call
-                tool_call_count += 1
-                function_name = function_call.get("name")
-                function_args_str = function_call.get("arguments", "{}")
+                # Abort if the model keeps requesting the exact same tool calls
+                call_signatures = [
+                    (
+                        tool_call["function"]["name"],
+                        hashlib.blake2b(
+                            (tool_call["function"].get("arguments") or "{}").encode(),
+                            digest_size=8
+                        ).digest()
+                    )
+                    for tool_call in tool_calls
+                ]
+                recent_turns.append(tuple(call_signatures))
+                if len(recent_turns) == recent_turns.maxlen and len(set(recent_turns)) == 1:
+                    logger.warning("Tool loop detected: same tool calls requested %s times in a row", recent_turns.maxlen)
+                    return {
+                        "success": False,
+                        "error": "tool_loop_detected",
+                        "tool_calls_made": tool_call_count
+                    }
                 
-                try:
-                    function_args = json.loads(function_args_str)
-                except json.JSONDecodeError:
-                    function_args = {}
+                # Execute the whole batch of tool calls concurrently; it counts as one round
+                tool_round += 1
+                tool_call_count += len(tool_calls)
                 
-                logger.info(f"🔧 Executing tool: {function_name}")
+                coros = []
+                for tool_call in tool_calls:
+                    function_name = tool_call["function"]["name"]
+                    function_args_str = tool_call["function"].get("arguments") or "{}"
+                    
+                    try:
+                        function_args = orjson.loads(function_args_str)
+                    except orjson.JSONDecodeError:
+                        function_args = {}
+                    
+                    logger.info("🔧 Executing tool: %s", function_name)
+                    if function_name == MCP_BATCH_FUNCTION["name"]:
+                        coros.append(self._execute_mcp_batch(function_args))
+                    else:
+                        coros.append(self._execute_mcp_tool(function_name, function_args))
                 
-                # Execute the MCP tool
-                tool_result = await self._execute_mcp_tool(function_name, function_args)
-                logger.info(f"MCP Tool Result ({function_name}): {json.dumps(tool_result, indent=2)}")
-
-                # Add function result to conversation
-                function_message = {
-                    "role": "function",
-                    "name": function_name,
-                    "content": json.dumps(tool_result)
-                }
-                messages.append(function_message)
+                # Execute the MCP tools
+                results = await asyncio.gather(*coros, return_exceptions=True)
+                
+                repeated_output_tool = None
+                turn_outputs = set()
+                for tool_call, signature, tool_result in zip(tool_calls, call_signatures, results):
+                    function_name = tool_call["function"]["name"]
+                    if isinstance(tool_result, BaseException):
+                        tool_result = f"Tool execution failed: {str(tool_result)}"
+                        recent_failures.append(signature)
+                        
+                        # A repeated error trace only re-inflates the prompt; send a short tag instead
+                        output_hash = hashlib.blake2s(tool_result.encode(), digest_size=8).hexdigest()
+                        output_key = (function_name, output_hash)
+                        if output_key in turn_outputs:
+                            # Already sent in full (or tagged) earlier in this turn; not a new repeat
+                            tool_result = f"[duplicate tool output, hash={output_hash}]"
+                        else:
+                            turn_outputs.add(output_key)
+                            seen_outputs[output_key] = seen_outputs.get(output_key, 0) + 1
+                            if seen_outputs[output_key] >= 2:
+                                tool_result = f"[duplicate tool output, turn #{seen_outputs[output_key]}, hash={output_hash}]"
+                            if seen_outputs[output_key] >= 3:
+                                repeated_output_tool = function_name
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("MCP Tool Result (%s): %s", function_name, tool_result)
+                    
+                    # Add tool result to conversation
+                    tool_message = {
+                        "role": "tool",
+                        "tool_call_id": tool_call.get("id"),
+                        "content": tool_result
+                    }
+                    messages.append(tool_message)
+                
+                logger.info("✅ Executed %s tool call(s)", len(tool_calls))
+                
+                # Abort if the same error keeps coming back, or the same call keeps failing,
+                # rather than re-sending the history again
+                if repeated_output_tool is not None:
+                    logger.warning("Tool %s returned the same error output in 3 turns", repeated_output_tool)
+                    return {
+                        "success": False,
+                        "error": "repeated_tool_output",
+                        "tool": repeated_output_tool,
+                        "tool_calls_made": tool_call_count
+                    }
+                
+                if len(recent_failures) == recent_failures.maxlen and len(set(recent_failures)) == 1:
+                    failed_tool = recent_failures[-1][0]
+                    logger.warning("Tool %s failed %s times with the same arguments", failed_tool, recent_failures.maxlen)
+                    return {
+                        "success": False,
+                        "error": "repeated_failing_tool_call",
+                        "tool": failed_tool,
+                        "tool_calls_made": tool_call_count
+                    }
                 
-                logger.info(f"✅ Tool {function_name} executed successfully")
+                # Keep the history sent on the next turn from growing with stale tool output
+                self._prune_tool_history(messages)
             
             # Max tool calls reached
-            logger.warning(f"Maximum tool calls ({max_tool_calls}) reached")
+            logger.warning("Maximum tool call rounds (%s) reached", max_tool_calls)
             return {
                 "success": False,
-                "error": f"Maximum tool calls ({max_tool_calls}) reached",
+                "error": f"Maximum tool call rounds ({max_tool_calls}) reached",
                 "tool_calls_made": tool_call_count,
                 "partial_response": messages[-1].get("content", "") if messages else ""
             }
             
         except Exception as e:
-            logger.error(f"Failed to process request: {e}")
+            logger.error("Failed to process request: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -290,11 +923,24 @@ class LiteLLMAgent:
             }
 
 
+def run_async(main: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine like asyncio.run(), on uvloop's faster event loop when it is installed"""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(main)
+    
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(main)
+    
+    uvloop.install()
+    return asyncio.run(main)
+
+
 # Example usage and testing
 async def main():
     """Example usage of the LiteLLMAgent"""
-    agent = LiteLLMAgent()
-    
     # Test request
     test_request = "What's the weather like in San Francisco?"
     
@@ -302,11 +948,12 @@ async def main():
     print(f"Request: {test_request}")
     print("=" * 50)
     
-    result = await agent.process_request(test_request)
+    async with LiteLLMAgent() as agent:
+        result = await agent.process_request(test_request)
     
     print("\n📋 Result:")
     print(json.dumps(result, indent=2))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run_async(main())
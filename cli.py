@@ -6,12 +6,81 @@ Interactive CLI for the LiteLLM MCP Agent
 import asyncio
 import argparse
 import sys
-from agent import LiteLLMAgent
+import os
+from agent import LiteLLMAgent, run_async
+
+async def ainput(prompt: str = "") -> str:
+    """Read a line from stdin without blocking the event loop."""
+    print(prompt, end="", flush=True)
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    future = loop.create_future()
+    line = bytearray()
+    
+    def settle(result, error):
+        # Stop reading first, so no byte of the next line is consumed into this one
+        loop.remove_reader(fd)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def read_byte():
+        # One byte per wakeup, so nothing past the newline is buffered away from the next read
+        try:
+            byte = os.read(fd, 1)
+        except OSError as e:
+            settle(None, e)
+            return
+        if not byte:
+            settle(None, EOFError())
+        elif byte == b"\n":
+            settle(line.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r"), None)
+        else:
+            line.extend(byte)
+    
+    try:
+        loop.add_reader(fd, read_byte)
+    except (NotImplementedError, PermissionError):
+        # No reader support for this loop or stdin (Windows, a regular file): read directly
+        text = sys.stdin.readline()
+        if not text:
+            raise EOFError()
+        return text.rstrip("\n")
+    try:
+        return await future
+    finally:
+        loop.remove_reader(fd)
+
+class StreamPrinter:
+    """Prints streamed response text, adding the response prefix before the first chunk."""
+    
+    def __init__(self):
+        self.started = False
+        self.at_line_start = True
+    
+    def __call__(self, delta: str):
+        if not self.started and delta != "\n":
+            print("🤖 Response: ", end="")
+            self.started = True
+        print(delta, end="", flush=True)
+        self.at_line_start = delta.endswith("\n")
+    
+    def finish(self):
+        """End a line left open by a stream that stopped part-way."""
+        if not self.at_line_start:
+            print()
+            self.at_line_start = True
 
 async def interactive_mode():
     """Run the agent in interactive mode."""
     agent = LiteLLMAgent()
     
+    # Fetch the MCP tools while the user is typing their first request
+    agent.prefetch_tools()
+    
     try:
         print("\n" + "="*60)
         print("LiteLLM MCP Agent - Interactive Mode")
@@ -24,7 +93,7 @@ async def interactive_mode():
         while True:
             try:
                 # Get user input
-                prompt = input("\nEnter your request: ").strip()
+                prompt = (await ainput("\nEnter your request: ")).strip()
                 
                 if prompt.lower() in ['quit', 'exit', 'q']:
                     break
@@ -55,21 +124,26 @@ async def interactive_mode():
                     continue
                 
                 # Get model preference
-                model = input("Model (press Enter for gpt-3.5-turbo): ").strip()
+                model = (await ainput("Model (press Enter for gpt-3.5-turbo): ")).strip()
                 if not model:
                     model = "gpt-3.5-turbo"
                 
                 print(f"\nProcessing with {model}...")
                 print("-" * 40)
                 
-                # Process the request
-                result = await agent.process_request(prompt, model)
+                # Process the request, printing the response as it streams in
+                printer = StreamPrinter()
+                try:
+                    result = await agent.process_request(prompt, model, stream=True, on_delta=printer)
+                finally:
+                    printer.finish()
                 
                 # Display results
                 if not result.get('success'):
                     print(f"❌ Error: {result.get('error', 'Unknown error')}")
                 else:
-                    print(f"🤖 Response: {result.get('response', 'No response')}")
+                    if not printer.started:
+                        print(f"🤖 Response: {result.get('response') or 'No response'}")
                     
                     if result.get('tool_calls_made', 0) > 0:
                         print(f"\n🔧 Tools used: {result['tool_calls_made']}")
@@ -77,13 +151,21 @@ async def interactive_mode():
                     if result.get('total_tokens'):
                         print(f"\n📊 Tokens used: {result['total_tokens']}")
                 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                # Under asyncio.Runner, Ctrl+C arrives as a cancellation of this task
+                task = asyncio.current_task()
+                if task is not None and hasattr(task, "uncancel"):
+                    task.uncancel()
                 print("\n\nInterrupted by user")
                 break
+            except EOFError:
+                # stdin was closed, e.g. Ctrl+D or the end of piped input
+                break
             except Exception as e:
                 print(f"\n❌ Unexpected error: {e}")
     
     finally:
+        await agent.aclose()
         print("\nGoodbye! 👋")
 
 async def single_request_mode(prompt: str, model: str):
@@ -99,6 +181,9 @@ async def single_request_mode(prompt: str, model: str):
         
     except Exception as e:
         print(json.dumps({"success": False, "error": str(e)}, indent=2))
+    
+    finally:
+        await agent.aclose()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -139,10 +224,10 @@ Examples:
     try:
         if args.prompt:
             # Single request mode
-            asyncio.run(single_request_mode(args.prompt, args.model))
+            run_async(single_request_mode(args.prompt, args.model))
         else:
             # Interactive mode
-            asyncio.run(interactive_mode())
+            run_async(interactive_mode())
     except KeyboardInterrupt:
         print("\nExiting...")
         sys.exit(0)
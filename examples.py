@@ -22,7 +22,7 @@ async def example_basic_usage():
         print(f"Response: {result.get('response')}")
         
     finally:
-        await agent.close()
+        await agent.aclose()
 
 async def example_with_tools():
     """Example that might trigger tool usage."""
@@ -49,7 +49,7 @@ async def example_with_tools():
             print(f"\nFinal response: {result['final_response']}")
         
     finally:
-        await agent.close()
+        await agent.aclose()
 
 async def example_different_models():
     """Example using different models."""
@@ -73,7 +73,7 @@ async def example_different_models():
                 print(f"Tokens: {result.get('total_tokens', 'N/A')}")
                 
     finally:
-        await agent.close()
+        await agent.aclose()
 
 async def main():
     """Run all examples."""